@@ -21,143 +21,498 @@
 # SOFTWARE.
 
 """ Implementation of arc consistency algorithm """
-from collections import namedtuple
-import copy
-from typing import Any, Dict, Iterable, List, Set
+from collections import defaultdict, deque
+import functools
+import itertools
+import logging
+import operator
+from typing import (Any, Callable, Dict, Iterable, List, Optional, Set,
+                    Tuple)
 
-from csp import CSP
+from csp import CSP, Constraint, FLIPPED_COMPARISONS
 
-# An arc in a constraint network
-Arc = namedtuple("Arc", ["constraint", "variable"])
+logger = logging.getLogger(__name__)
+
+class Arc:
+    """
+    An arc in a constraint network
+    The variable is given by its index in the CSP.
+
+    Arcs are used as set keys in the agenda all the time.
+    So the hash is computed only once. Constraints are compared by identity,
+    because each constraint of a CSP is a distinct object.
+    """
+    __slots__ = ("constraint", "variable", "_hash")
+
+    def __init__(self, constraint: Constraint, variable: int) -> None:
+        self.constraint = constraint
+        self.variable = variable
+        self._hash = hash((id(constraint), variable))
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, Arc):
+            return (self.constraint is other.constraint
+                    and self.variable == other.variable)
+        return False
+
+    def __repr__(self) -> str:
+        name = self.constraint.variables[
+            self.constraint.position(self.variable)]
+        return "Arc(constraint={!r}, variable={!r})".format(self.constraint,
+                                                            name)
 
 class Agenda:
     """ An agenda for arc consistency algorithm """
-    def __init__(self) -> None:
-        self._arcs = set()
+    def __init__(self, arcs: Iterable[Arc] = ()) -> None:
+        # Arcs in first-in first-out order
+        self._queue = deque()
+        # All arcs currently in `_queue` to suppress duplicates
+        self._in_queue = set()
+        for arc in arcs:
+            self.add_arc(arc)
 
     def add_arc(self, arc: Arc) -> None:
-        """ Add new arc """
-        self._arcs.add(arc)
+        """ Add new arc, if it is not on the agenda already """
+        if arc not in self._in_queue:
+            self._queue.append(arc)
+            self._in_queue.add(arc)
 
     def next_arc(self) -> Arc:
         """
         Remove and return next arc according to selection strategy
+        (first in, first out)
         """
-        return self._arcs.pop()
+        arc = self._queue.popleft()
+        self._in_queue.discard(arc)
+        return arc
 
     @property
     def is_empty(self) -> bool:
         """ True, if frontier is empty (no more arcs left) """
-        return not self._arcs
+        return not self._queue
 
     def __len__(self) -> int:
-        return len(self._arcs)
-
+        return len(self._queue)
 
-debug = True
-def debug_print(x: Any):
-    if debug:
-        print(x)
 
 def arc_consistency(csp: CSP) -> Dict[str, Set[Any]]:
     """ Try to solve CSP by arc consistency algorithm """
+    if is_bitmask_csp(csp):
+        masks = get_initial_bitmasks(csp)
+        masks = _arc_consistency_in_place(csp, masks, bitmask=True)
+        return {var: from_bitmask(mask)
+                for var, mask in zip(csp.var_names, masks)}
+
     # The possible values for each variable
     domains = get_initial_domains(csp)
+    domains = _arc_consistency_in_place(csp, domains)
+    return dict(zip(csp.var_names, domains))
+
+# Domains of all variables, indexed by the variable indices of a CSP
+Domains = List[Any]
+
+def _arc_consistency_in_place(csp: CSP, domains: Domains, *,
+                              bitmask: bool = False) -> Domains:
+    """
+    Arc consistency algorithm working directly on `domains`.
+    The entries of `domains` are replaced, but the sets themselves are never
+    modified. So the caller must only make sure that the list is not shared.
+
+    If `bitmask` is True, the domains are bitmasks (see `to_bitmask`).
+    """
+    # Unary constraints only need to be checked once
+    make_node_consistent(csp, domains, bitmask=bitmask)
+
     # The constraint network
     arcs = list(get_initial_arcs(csp))
+    # All arcs whose constraint involves a variable
+    var_to_arcs = get_arcs_by_variable(arcs)
 
     # initialize agenda
-    agenda = Agenda()
-    for initial_arc in arcs:
-        agenda.add_arc(initial_arc)
+    agenda = Agenda(arcs)
+
+    return arc_consistency_incremental(csp, domains, agenda,
+                                       bitmask=bitmask,
+                                       var_to_arcs=var_to_arcs)
+
+def arc_consistency_incremental(csp: CSP, domains: Domains,
+                                agenda: Agenda, *, bitmask: bool = False,
+                                var_to_arcs: Optional[Dict[int, List[Arc]]]
+                                = None) -> Domains:
+    """
+    Arc consistency algorithm that only starts with the arcs in `agenda`.
+    All other arcs must already be consistent with `domains`.
+    Like `_arc_consistency_in_place`, the entries of `domains` are replaced.
+
+    `var_to_arcs` is the index created by `get_arcs_by_variable`.
+    Pass it, if it is already known.
+    """
+    revise = make_consistent_bitmask if bitmask else make_consistent
+    if var_to_arcs is None:
+        var_to_arcs = get_arcs_by_variable(get_initial_arcs(csp))
+
+    # Even formatting of debug messages is too expensive for the main loop
+    log_debug = logger.isEnabledFor(logging.DEBUG)
 
     while not agenda.is_empty:
         current_arc = agenda.next_arc()
 
-        debug_print(current_arc)
-        debug_print("{} arcs left".format(len(agenda)))
+        if log_debug:
+            logger.debug("%s, %d arcs left", current_arc, len(agenda))
 
-        new_domain = make_consistent(current_arc, domains)
+        new_domain = revise(current_arc, domains)
         old_domain = domains[current_arc.variable]
 
         if new_domain != old_domain:
-            debug_print("new_domain for {0}: {1}"
-                        .format(current_arc.variable, new_domain))
-            for invalid_arc in invalidated_arcs(current_arc, arcs):
+            if log_debug:
+                logger.debug("new_domain for %s: %s",
+                             csp.var_names[current_arc.variable],
+                             from_bitmask(new_domain) if bitmask
+                             else new_domain)
+            for invalid_arc in invalidated_arcs(current_arc,
+                                                var_to_arcs):
                 agenda.add_arc(invalid_arc)
             domains[current_arc.variable] = new_domain
 
     return domains
 
-def get_initial_domains(csp: CSP) -> Dict[str, Set[Any]]:
+def get_initial_domains(csp: CSP) -> List[Set[Any]]:
     """ Get initial domains for all variables """
-    # deep copy because specification of CSP could have reused domains
-    # and we are going to modify the domains
-    return copy.deepcopy(csp.variables)
+    # copy each domain because specification of CSP could have reused
+    # domains and we are going to modify the domains.
+    # The values are never modified, so no need for a deep copy.
+    return [set(csp.variables[var]) for var in csp.var_names]
+
+def make_node_consistent(csp: CSP, domains: Domains, *,
+                         bitmask: bool = False) -> None:
+    """
+    Remove all values from `domains` that violate a unary constraint.
+    Like in `_arc_consistency_in_place`, the entries of `domains` are
+    replaced.
+    """
+    for constraint in csp.constraints:
+        if len(constraint.variables) != 1:
+            continue
+        var, = constraint.indices
+        check = constraint.check_values
+        if bitmask:
+            domains[var] = to_bitmask(value
+                                      for value in bitmask_values(domains[var])
+                                      if check((value,)))
+        else:
+            domains[var] = {value for value in domains[var]
+                            if check((value,))}
 
 def get_initial_arcs(csp: CSP) -> Iterable[Arc]:
-    """ One arc from each constraint to all of its variables """
+    """
+    One arc from each constraint to all of its variables.
+    Unary constraints have no arcs, see `make_node_consistent`.
+    """
     for constraint in csp.constraints:
-        for var in constraint.variables:
+        if len(constraint.variables) == 1:
+            continue
+        for var in constraint.indices:
             yield Arc(constraint=constraint,
                       variable=var)
 
-def make_consistent(arc: Arc, domains: Dict[str, Set[Any]]) -> Set[Any]:
+def get_arcs_by_variable(arcs: Iterable[Arc]) -> Dict[int, List[Arc]]:
+    """
+    Index arcs by variables: Map each variable to all arcs whose
+    constraint involves that variable.
+    """
+    var_to_arcs = defaultdict(list)
+    for arc in arcs:
+        for var in arc.constraint.indices:
+            var_to_arcs[var].append(arc)
+    return var_to_arcs
+
+def get_split_agenda(split_var: int,
+                     var_to_arcs: Dict[int, List[Arc]]) -> Agenda:
+    """
+    Get agenda of all arcs that need to be rechecked after the domain
+    of `split_var` has been reduced.
+    """
+    return Agenda(arc for arc in var_to_arcs[split_var]
+                  if arc.variable != split_var)
+
+def make_consistent(arc: Arc, domains: List[Set[Any]]) -> Set[Any]:
     """
     Make an arc consistent.
     Return new domain for `arc.variable`.
     """
-    other_vars = [var for var in arc.constraint.variables
-                  if var != arc.variable]
+    if arc.constraint.comparison is not None:
+        other_var, = arc.constraint.other_indices(arc.variable)
+        new_domain = compare_domains(get_arc_comparison(arc),
+                                     domains[arc.variable],
+                                     domains[other_var])
+        if new_domain is not None:
+            return new_domain
+
+    other_sets = [domains[var]
+                  for var in arc.constraint.other_indices(arc.variable)]
+
+    def is_valid(other_values: Tuple[Any, ...]) -> bool:
+        return all(value in domain
+                   for value, domain in zip(other_values, other_sets))
+
+    other_domains = [list(domain) for domain in other_sets]
+    return set(supported_values(arc, domains[arc.variable], other_domains,
+                                is_valid))
+
+def make_consistent_bitmask(arc: Arc, domains: List[int]) -> int:
+    """
+    Make an arc consistent, if all domains are bitmasks.
+    Return new domain for `arc.variable`.
+    """
+    if arc.constraint.comparison is not None:
+        other_var, = arc.constraint.other_indices(arc.variable)
+        return compare_bitmasks(get_arc_comparison(arc),
+                                domains[arc.variable], domains[other_var])
+
+    other_masks = [domains[var]
+                   for var in arc.constraint.other_indices(arc.variable)]
+
+    def is_valid(other_values: Tuple[int, ...]) -> bool:
+        return all(mask >> value & 1
+                   for value, mask in zip(other_values, other_masks))
 
-    current_domain = domains[arc.variable]
-    other_domains = {var: dom for (var, dom) in domains.items()
-                     if var in other_vars}
+    other_domains = [list(bitmask_values(mask)) for mask in other_masks]
+    new_domain = 0
+    for value in supported_values(arc, bitmask_values(domains[arc.variable]),
+                                  other_domains, is_valid):
+        new_domain |= 1 << value
+    return new_domain
+
+def supported_values(arc: Arc, current_domain: Iterable[Any],
+                     other_domains: List[List[Any]],
+                     is_valid: Callable[[Tuple[Any, ...]], bool]
+                     ) -> Iterable[Any]:
+    """
+    Generate all values from `current_domain` of `arc.variable`
+    that are supported by some combination of values from `other_domains`.
+    `other_domains` are the domains of all other variables of the constraint
+    in the order of `arc.constraint.variables`.
+
+    The support found for a value is remembered in
+    `arc.constraint.last_support`. As long as `is_valid` tells that all
+    values of the remembered support are still in the domains of the other
+    variables, the value needs no new search.
+    """
+    # values of `arc.variable` are inserted at this position
+    # into the values of all other variables
+    position = arc.constraint.position(arc.variable)
+    # local names avoid attribute lookups in the inner loop
+    check = arc.constraint.check_values
+    last_support = arc.constraint.last_support
 
-    new_domain = set()
     for value in current_domain:
-        for other_values in domain_product(other_domains):
-            all_values = other_values
-            all_values[arc.variable] = value
+        support = last_support.get((arc.variable, value))
+        if support is not None and is_valid(support):
+            yield value
+            continue
+
+        for other_values in itertools.product(*other_domains):
+            all_values = (other_values[:position] + (value,)
+                          + other_values[position:])
 
-            if arc.constraint.check(all_values):
-                new_domain.add(value)
+            if check(all_values):
+                last_support[(arc.variable, value)] = other_values
+                yield value
                 break
 
-    return new_domain
+def get_arc_comparison(arc: Arc) -> str:
+    """
+    Comparison operator of the constraint of `arc` with `arc.variable` as
+    left operand.
+    """
+    if arc.constraint.position(arc.variable) == 0:
+        return arc.constraint.comparison
+    return FLIPPED_COMPARISONS[arc.constraint.comparison]
 
-Assignment = Dict[str, Any]
+# Values of these types can be compared by order with each other
+ORDERED_TYPES = (int, float)
 
-def domain_product(domains: Dict[str, Set[Any]]) -> Iterable[Assignment]:
+def compare_domains(comparison: str, current_domain: Set[Any],
+                    other_domain: Set[Any]) -> Optional[Set[Any]]:
     """
-    Generate all possible combinations of values in domains.
-    Yield an assignmnent (variable: value) from cartesian product of all
-    domains.
+    Get all values `a` from `current_domain` for which there is a value `b`
+    in `other_domain`, such that `a <comparison> b`.
+    This is done by set operations instead of checking pairs of values.
+    Return None, if the values cannot be compared by order this way.
     """
-    def get_assignment(domains: Dict[str, Set[Any]]) -> Iterable[Assignment]:
-        # termination
-        if not domains:
-            yield {}
-        else:
-            # Reduce by one variable and get all assingnment for remaining
-            # variables
-            remaining_domains = domains.copy()
-            var, domain = remaining_domains.popitem()
-            for remaining_assignment in get_assignment(remaining_domains):
-                for value in domain:
-                    remaining_assignment[var] = value
-                    yield remaining_assignment
-    return get_assignment(domains)
-
-def invalidated_arcs(current_arc: Arc, arcs: List[Arc]) -> Iterable[Arc]:
+    if not other_domain:
+        return set()
+    if comparison == "==":
+        # Not `current_domain & other_domain`: That may take equal values
+        # from `other_domain`, e.g. 1 instead of 1.0
+        return {value for value in current_domain if value in other_domain}
+    if comparison == "!=":
+        # Only a single value in the other domain can rule out a value
+        if len(other_domain) == 1:
+            return current_domain - other_domain
+        return current_domain
+
+    if not all(type(value) in ORDERED_TYPES
+               for value in itertools.chain(current_domain, other_domain)):
+        return None
+    if comparison in ("<", "<="):
+        bound = max(other_domain)
+    else:
+        bound = min(other_domain)
+    compare = COMPARE_FUNCTIONS[comparison]
+    return {value for value in current_domain if compare(value, bound)}
+
+COMPARE_FUNCTIONS = {"<": operator.lt, "<=": operator.le,
+                     ">": operator.gt, ">=": operator.ge}
+
+def compare_bitmasks(comparison: str, current_domain: int,
+                     other_domain: int) -> int:
+    """
+    Same as `compare_domains`, but for bitmask domains.
+    """
+    if not other_domain:
+        return 0
+    if comparison == "==":
+        return current_domain & other_domain
+    if comparison == "!=":
+        # Only a single value in the other domain can rule out a value
+        if other_domain & (other_domain - 1) == 0:
+            return current_domain & ~other_domain
+        return current_domain
+
+    highest = other_domain.bit_length() - 1
+    lowest = (other_domain & -other_domain).bit_length() - 1
+    if comparison == "<":
+        # all values below the highest other value
+        return current_domain & ((1 << highest) - 1)
+    if comparison == "<=":
+        return current_domain & ((1 << (highest + 1)) - 1)
+    if comparison == ">":
+        # all values above the lowest other value
+        return current_domain & ~((1 << (lowest + 1)) - 1)
+    assert comparison == ">="
+    return current_domain & ~((1 << lowest) - 1)
+
+# Domains of small non-negative integers are represented as bitmasks:
+# Value v is in the domain, if bit v is set.
+# Set operations then become single operations on integers.
+BITMASK_LIMIT = 64
+
+def is_bitmask_csp(csp: CSP) -> bool:
+    """ All values of all domains can be represented by bitmasks """
+    # bool is a subclass of int, but must not be turned into an int
+    return all(type(value) is int and 0 <= value < BITMASK_LIMIT
+               for domain in csp.variables.values()
+               for value in domain)
+
+def get_initial_bitmasks(csp: CSP) -> List[int]:
+    """ Get initial domains for all variables as bitmasks """
+    return [to_bitmask(csp.variables[var]) for var in csp.var_names]
+
+def to_bitmask(domain: Iterable[int]) -> int:
+    """ Convert a domain of small non-negative integers to a bitmask """
+    return functools.reduce(operator.or_, (1 << value for value in domain), 0)
+
+def from_bitmask(mask: int) -> Set[int]:
+    """ Convert a bitmask to a domain """
+    return set(bitmask_values(mask))
+
+def bitmask_values(mask: int) -> Iterable[int]:
+    """ Generate all values of a bitmask domain in ascending order """
+    while mask:
+        # lowest bit that is set
+        yield (mask & -mask).bit_length() - 1
+        mask &= mask - 1
+
+def invalidated_arcs(current_arc: Arc,
+                     var_to_arcs: Dict[int, List[Arc]]) -> Iterable[Arc]:
     """
     Generate all arcs that have been invalidated by making
     `current_arc` consistent.
+    The arc that has just been made consistent is never invalidated again.
+
+    `var_to_arcs` is the index created by `get_arcs_by_variable`.
     """
     current_var = current_arc.variable
 
-    return [arc for arc in arcs
-            if arc.constraint != current_arc.constraint
-            and current_var in arc.constraint.variables
+    return [arc for arc in var_to_arcs[current_var]
+            if arc.constraint is not current_arc.constraint
             and arc.variable != current_var]
 
+
+# A value of a variable, i.e. a (variable index, value) pair
+VarValue = Tuple[int, Any]
+
+def ac4(csp: CSP) -> Dict[str, Set[Any]]:
+    """
+    Try to solve CSP by the AC-4 arc consistency algorithm.
+
+    Instead of searching for supports each time an arc is revisited,
+    all supporting tuples of each constraint are enumerated once.
+    Each value of a variable keeps a counter of its supports per constraint.
+    When a value is removed, the counters of all values that were supported
+    by it are decremented. A value without supports is removed as well.
+
+    Return the same domains as `arc_consistency`.
+    """
+    domains = get_initial_domains(csp)
+
+    # Constraints are referred to by their position in `csp.constraints`.
+    # Constraints compare equal by their function, so they cannot be used as
+    # keys: Two constraints with the same function would collide.
+
+    # Number of supporting tuples for each (constraint, variable, value)
+    counter: Dict[Tuple[int, int, Any], int] = defaultdict(int)
+    # Supporting tuples of each constraint that are still valid
+    tuples: List[List[Tuple[VarValue, ...]]] = []
+    alive: List[List[bool]] = []
+    # Inverse index: all tuples (constraint, tuple index) a value occurs in
+    supported_by: Dict[VarValue, List[Tuple[int, int]]] = defaultdict(list)
+
+    for number, constraint in enumerate(csp.constraints):
+        variables = constraint.indices
+        constraint_domains = [domains[var] for var in variables]
+        constraint_tuples = []
+        for values in itertools.product(*constraint_domains):
+            if not constraint.check_values(values):
+                continue
+            support = tuple(zip(variables, values))
+            index = len(constraint_tuples)
+            constraint_tuples.append(support)
+            for var_value in support:
+                counter[(number, var_value[0], var_value[1])] += 1
+                supported_by[var_value].append((number, index))
+        tuples.append(constraint_tuples)
+        alive.append([True] * len(constraint_tuples))
+
+    # Values that have been removed, but whose supports have not been
+    # updated yet
+    pruned: deque = deque()
+
+    # Initial sweep: Remove all values without any support
+    for number, constraint in enumerate(csp.constraints):
+        for var in constraint.indices:
+            for value in list(domains[var]):
+                if counter[(number, var, value)] == 0:
+                    domains[var].discard(value)
+                    pruned.append((var, value))
+
+    while pruned:
+        removed_var, removed_value = pruned.popleft()
+        for number, index in supported_by[(removed_var, removed_value)]:
+            if not alive[number][index]:
+                continue
+            alive[number][index] = False
+            for var, value in tuples[number][index]:
+                if var == removed_var:
+                    continue
+                key = (number, var, value)
+                counter[key] -= 1
+                if counter[key] == 0 and value in domains[var]:
+                    domains[var].discard(value)
+                    pruned.append((var, value))
+
+    return dict(zip(csp.var_names, domains))
@@ -68,29 +68,126 @@ This CSP has two solutions:
 A = 1, B = 2, C = 1
 A = 2, B = 3, C = 1
 """
+import ast
+import copy
+import hashlib
 import importlib
 import inspect
+import logging
+import os
 from pathlib import Path
+import pickle
 import sys
-from typing import Any, Callable, Dict, List, Optional, Set
+import tempfile
+import textwrap
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
 
 class Constraint:
     """ A constraint in a CSP """
     def __init__(self, function: Callable, *,
-                 variables: Optional[List[str]] = None,
-                 name: Optional[str] = None) -> None:
+                 variables: Optional[Sequence[str]] = None,
+                 name: Optional[str] = None,
+                 comparison: Optional[str] = None) -> None:
         self.function = function
-        self._variables = variables
+        # Whether the function can be called with the values as positional
+        # arguments, which is faster than passing them by keyword
+        self._positional = False
+        if variables is None:
+            # Inspecting the signature is slow, so do it only once
+            signature = inspect.signature(function)
+            variables = signature.parameters.keys()
+            self._positional = all(
+                parameter.kind == inspect.Parameter.POSITIONAL_OR_KEYWORD
+                for parameter in signature.parameters.values())
+        self._variables = tuple(variables)
         self._name = name
+        # Comparison operator, if the constraint just compares its two
+        # variables: `variables[0] <comparison> variables[1]`.
+        # See `get_comparison`.
+        self.comparison = comparison
+
+        # Indices of the variables in a CSP, only set on the copy returned
+        # by `bind`
+        self.indices: Optional[Tuple[int, ...]] = None
+        # Lookups by variable index for arc consistency,
+        # which needs them for every arc
+        self._positions: Dict[int, int] = {}
+        self._other_indices: Dict[int, Tuple[int, ...]] = {}
+
+        # Evaluate the constraint for values given in the same order as
+        # `variables`. An attribute instead of a method, because arc
+        # consistency calls it for every combination of values.
+        self.check_values = self._make_check()
+
+        # Last support found by arc consistency for a value of a variable:
+        # (variable index, value) -> values of all other variables.
+        # See `arc_consistency.supported_values`.
+        self.last_support: Dict[Tuple[int, Any], Tuple[Any, ...]] = {}
+
+    def _make_check(self) -> Callable[[Tuple[Any, ...]], bool]:
+        """ Make the function for `check_values` """
+        function = self.function
+        if self._positional:
+            def check_values(values: Tuple[Any, ...]) -> bool:
+                return function(*values)
+        else:
+            variables = self._variables
+            def check_values(values: Tuple[Any, ...]) -> bool:
+                return function(**dict(zip(variables, values)))
+        return check_values
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        # The check is a local function and cannot be pickled.
+        # The function itself is pickled by reference to its module.
+        del state["check_values"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.check_values = self._make_check()
 
     @property
-    def variables(self) -> List[str]:
+    def variables(self) -> Tuple[str, ...]:
         """ Names of all variables that are involved in this constraint """
-        if self._variables is not None:
-            return self._variables
-        signature = inspect.signature(self.function)
-        func_params = list(signature.parameters.keys())
-        return func_params
+        return self._variables
+
+    def bind(self, var_index: Dict[str, int]) -> "Constraint":
+        """
+        Return a copy of this constraint with its variables bound to their
+        indices in a CSP. `var_index` maps each variable name to its index.
+        The copy starts without any state of the algorithms, so the same
+        constraint can be used in several CSPs.
+
+        Raise RuntimeError, if a variable is not in `var_index`.
+        """
+        for var in self._variables:
+            if var not in var_index:
+                raise RuntimeError("Constraint '{0}' has unknown variable "
+                                   "'{1}'.".format(self.name, var))
+        bound = copy.copy(self)
+        bound.indices = tuple(var_index[var] for var in self._variables)
+        bound._positions = {index: position
+                            for position, index in enumerate(bound.indices)}
+        bound._other_indices = {
+            index: tuple(other for other in bound.indices if other != index)
+            for index in bound.indices
+        }
+        bound.last_support = {}
+        return bound
+
+    def position(self, index: int) -> int:
+        """ Position of the variable with index `index` in `variables` """
+        return self._positions[index]
+
+    def other_indices(self, index: int) -> Tuple[int, ...]:
+        """
+        Indices of all variables of this constraint except the one
+        with index `index` in order of `variables`
+        """
+        return self._other_indices[index]
 
     @property
     def name(self) -> str:
@@ -101,7 +198,8 @@ class Constraint:
 
     def check(self, assignment: Dict[str, Any]) -> bool:
         """ Evaluate constraint for an assignment of variables """
-        return self.function(**assignment)
+        return self.check_values(tuple(assignment[var]
+                                       for var in self._variables))
 
     def __str__(self) -> str:
         result = "{}({})".format(self.name, ", ".join(self.variables))
@@ -119,6 +217,78 @@ class Constraint:
         return hash(self.function)
 
 
+# Comparison operators that are recognized by `get_comparison`
+COMPARISONS = {ast.Eq: "==", ast.NotEq: "!=",
+               ast.Lt: "<", ast.LtE: "<=",
+               ast.Gt: ">", ast.GtE: ">="}
+
+# The comparison with swapped operands: `a op b` is `b FLIPPED[op] a`
+FLIPPED_COMPARISONS = {"==": "==", "!=": "!=",
+                       "<": ">", "<=": ">=",
+                       ">": "<", ">=": "<="}
+
+def get_comparison(function: Callable) -> Optional[str]:
+    """
+    Find out, if a constraint function just compares its two arguments,
+    like
+
+        def ConstraintLessThan(A, B):
+            return A < B
+
+    Return the comparison operator for the arguments in order of the
+    signature, e.g. ">" for `return B < A`.
+    Return None, if the function does anything else
+    or its source is not available.
+    """
+    # The source of a wrapper, e.g. made by `functools.wraps`, would be
+    # the source of the wrapped function
+    if inspect.unwrap(function) is not function:
+        return None
+    code = getattr(function, "__code__", None)
+    if code is None:
+        return None
+    try:
+        tree = ast.parse(textwrap.dedent(inspect.getsource(function)))
+    except (OSError, TypeError, SyntaxError):
+        return None
+
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.FunctionDef):
+        return None
+    func_def = tree.body[0]
+    if func_def.name != code.co_name:
+        return None
+    args = func_def.args
+    if (func_def.decorator_list or args.posonlyargs or args.vararg
+            or args.kwonlyargs or args.kwarg or len(args.args) != 2):
+        return None
+    params = [arg.arg for arg in args.args]
+
+    body = func_def.body
+    # Skip docstring
+    if (len(body) == 2 and isinstance(body[0], ast.Expr)
+            and isinstance(body[0].value, ast.Constant)
+            and isinstance(body[0].value.value, str)):
+        body = body[1:]
+    if len(body) != 1 or not isinstance(body[0], ast.Return):
+        return None
+
+    expr = body[0].value
+    if not isinstance(expr, ast.Compare) or len(expr.ops) != 1:
+        return None
+    left, right = expr.left, expr.comparators[0]
+    if not isinstance(left, ast.Name) or not isinstance(right, ast.Name):
+        return None
+    operator = COMPARISONS.get(type(expr.ops[0]))
+    if operator is None:
+        return None
+
+    if [left.id, right.id] == params:
+        return operator
+    if [right.id, left.id] == params:
+        return FLIPPED_COMPARISONS[operator]
+    return None
+
+
 RepresentationFunc = Callable[[Dict[str, Any]], str]
 
 class CSP:
@@ -127,8 +297,18 @@ class CSP:
                  constraints: List[Constraint],
                  representation: Optional[RepresentationFunc]) -> None:
         self.variables = variables
-        self.constraints = constraints
         self.representation = representation
+        # True, if this CSP was loaded by `load_from_cache`
+        self.from_cache = False
+
+        # Algorithms refer to variables by their index in `var_names`,
+        # so that domains can be kept in a list.
+        self.var_names = list(variables)
+        self.var_index = {var: index
+                          for index, var in enumerate(self.var_names)}
+        # Copies of the constraints bound to this CSP
+        self.constraints = [constraint.bind(self.var_index)
+                            for constraint in constraints]
 
     @staticmethod
     def from_module(module: Any) -> "CSP":
@@ -136,7 +316,8 @@ class CSP:
         Construct a CSP instance from a python module
         The module must have `Variables` and `Constraints` attributes.
 
-        Raises RuntimeError, if the module has not all required attributes.
+        Raises RuntimeError, if the module has not all required attributes
+        or a constraint has a variable that is not in `Variables`.
         """
         if not hasattr(module, "Variables"):
             raise RuntimeError("Module '{0}' has no 'Variables' member."
@@ -152,7 +333,8 @@ class CSP:
             representation = None
 
         constraints = [
-            func if isinstance(func, Constraint) else Constraint(func)
+            func if isinstance(func, Constraint)
+            else Constraint(func, comparison=get_comparison(func))
             for func in module.Constraints
         ]
         return CSP(variables=module.Variables,
@@ -160,10 +342,19 @@ class CSP:
                    representation=representation)
 
     @staticmethod
-    def from_file(module_path: Path) -> "CSP":
+    def from_file(module_path: Path,
+                  cache_dir: Optional[Path] = None) -> "CSP":
         """
         Load a python module and pass it to `from_module`.
 
+        If `cache_dir` is given and it has a CSP saved by `save_to_cache`
+        for the same module source, load that one instead.
+        Unpickling the cached CSP still imports the module, because the
+        constraints are pickled by reference. What is saved are the
+        supports found by arc consistency (see `Constraint.last_support`),
+        so that they need not be searched again.
+        The returned CSP has `from_cache` set.
+
         Raise RuntimeError, if `module_path` is not a python source file.
         Raise any exception that the module raises during import.
         """
@@ -180,6 +371,74 @@ class CSP:
         directory = full_path.parent
         sys.path.insert(0, str(directory))
 
+        if cache_dir is not None:
+            cached = load_from_cache(full_path, cache_dir)
+            if cached is not None:
+                return cached
+
         module_name = full_path.stem
         module = importlib.import_module(module_name)
         return CSP.from_module(module)
+
+    def save_to_cache(self, module_path: Path, cache_dir: Path) -> None:
+        """
+        Save this CSP for `CSP.from_file` including everything the
+        algorithms have attached to its constraints.
+        The CSP is saved for the current source of `module_path`.
+
+        If the CSP cannot be pickled, e.g. because a constraint is not a
+        module level function, nothing is saved.
+        The file is written to a temporary file first and then renamed,
+        so that an interrupted run does not leave a truncated cache file.
+        """
+        path = get_cache_path(module_path, cache_dir)
+        try:
+            data = pickle.dumps(self)
+        except (pickle.PicklingError, AttributeError, TypeError) as error:
+            logger.debug("CSP from '%s' cannot be cached: %s",
+                         module_path, error)
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        file_descriptor, temp_name = tempfile.mkstemp(dir=str(path.parent),
+                                                      suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as temp_file:
+                temp_file.write(data)
+            os.replace(temp_name, str(path))
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+
+
+def get_cache_path(module_path: Path, cache_dir: Path) -> Path:
+    """
+    Path of the cached CSP for a module.
+    The name is a hash of the module source, so that changing the module
+    invalidates the cache. Changes to modules imported by the module
+    or to data files read by the module are not detected.
+    """
+    full_path = module_path.expanduser().resolve()
+    key = hashlib.blake2b(full_path.read_bytes()).hexdigest()
+    return cache_dir.expanduser() / "{0}.pkl".format(key)
+
+def load_from_cache(module_path: Path, cache_dir: Path) -> Optional[CSP]:
+    """
+    Load the CSP saved by `CSP.save_to_cache` for the current source of
+    `module_path`. Return None, if there is none.
+    A cache file that cannot be unpickled, e.g. because it is corrupt,
+    is deleted and treated as missing.
+    The directory of the module must already be in `sys.path`.
+    """
+    path = get_cache_path(module_path, cache_dir)
+    if not path.exists():
+        return None
+    try:
+        with path.open("rb") as cache_file:
+            csp = pickle.load(cache_file)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError,
+            IndexError, TypeError, ValueError) as error:
+        logger.debug("Ignoring invalid cache file '%s': %s", path, error)
+        path.unlink()
+        return None
+    csp.from_cache = True
+    return csp
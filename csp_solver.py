@@ -27,6 +27,9 @@ arc consistency algorithm.
 """
 import argparse
 import itertools
+import logging
+import math
+import os
 from pathlib import Path
 from pprint import pprint
 from typing import Any, Dict, Iterable, Set, Tuple
@@ -35,6 +38,9 @@ from csp import CSP, RepresentationFunc
 from arc_consistency import arc_consistency
 from domain_splitting import domain_splitting
 
+# Directory for cached CSPs, see `CSP.save_to_cache`
+CACHE_DIR = Path("~/.cache/csp")
+
 def parse_args() -> argparse.Namespace:
     """
     Parse command line arguments.
@@ -43,6 +49,9 @@ def parse_args() -> argparse.Namespace:
 
     csp_module: str - The CSP module path.
     find_all: bool - Find all solutions or just one.
+    debug: bool - Print debug output of the algorithms.
+    cache: bool - Use the cache of loaded CSPs.
+    ac4: bool - Use AC-4 for the initial arc consistency.
     """
     parser = argparse.ArgumentParser(description=__doc__)
 
@@ -52,6 +61,23 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--find-all", "-a", action="store_true",
                         help="Find all solutions")
 
+    parser.add_argument("--debug", "-d", action="store_true",
+                        help="Print debug output of the algorithms")
+
+    parser.add_argument("--cache", "-c", action="store_true",
+                        help="Reuse the supports found by arc consistency "
+                        "in the last run with the same module source "
+                        "(stored in {0}). The module is still imported, "
+                        "and changes to files it reads are not detected"
+                        .format(CACHE_DIR))
+
+    parser.add_argument("--ac4", action="store_true",
+                        help="Make the CSP arc consistent by the AC-4 "
+                        "algorithm before splitting. It checks all "
+                        "combinations of values of each constraint once, "
+                        "so it only pays off for constraints over "
+                        "few variables")
+
     args = parser.parse_args()
     return args
 
@@ -65,21 +91,23 @@ def print_solution(solution: Dict[str, Any],
         pprint(solution)
     print("")
 
-def find_one_solution(csp: CSP) -> None:
+def find_one_solution(csp: CSP, use_ac4: bool) -> None:
     """ Find and print one solution """
-    solutions = domain_splitting(csp)
-    has_solution = False
-    for solution in solutions:
-        has_solution = True
+    solutions = domain_splitting(csp, use_ac4=use_ac4)
+    solution = next(solutions, None)
+    if solution is not None:
         print_solution(solution, csp.representation)
-        break
-    if not has_solution:
+    else:
         print("No solution.")
 
 
-def find_all_solutions(csp: CSP) -> None:
+def find_all_solutions(csp: CSP, use_ac4: bool) -> None:
     """ Find and print all solutions """
-    solutions = list(domain_splitting(csp))
+    # Split the CSP into about one sub problem per CPU.
+    # Each sub problem is solved in its own process.
+    parallel_depth = math.ceil(math.log2(os.cpu_count() or 1))
+    solutions = list(domain_splitting(csp, parallel_depth=parallel_depth,
+                                      use_ac4=use_ac4))
     for solution in solutions:
         print_solution(solution, csp.representation)
 
@@ -88,12 +116,24 @@ def main():
     """ Main program """
     args = parse_args()
 
-    csp = CSP.from_file(Path(args.csp_module))
+    if args.debug:
+        logging.basicConfig(format="%(message)s")
+        # Only debug output of this program, not of any library
+        for logger_name in ("csp", "arc_consistency", "domain_splitting"):
+            logging.getLogger(logger_name).setLevel(logging.DEBUG)
+
+    module_path = Path(args.csp_module)
+    cache_dir = CACHE_DIR if args.cache else None
+    csp = CSP.from_file(module_path, cache_dir=cache_dir)
 
     if args.find_all:
-        find_all_solutions(csp)
+        find_all_solutions(csp, args.ac4)
     else:
-        find_one_solution(csp)
+        find_one_solution(csp, args.ac4)
+
+    # A CSP from the cache is already saved
+    if args.cache and not csp.from_cache:
+        csp.save_to_cache(module_path, CACHE_DIR)
 
 if __name__ == "__main__":
     main()
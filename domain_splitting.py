@@ -21,87 +21,242 @@
 # SOFTWARE.
 
 """ Domain splitting algorithm for solving CSPs. """
-import itertools
-from typing import Any, Dict, Iterable, Set, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import multiprocessing
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
 from csp import CSP
-from arc_consistency import arc_consistency
+from arc_consistency import (Agenda, Arc, Domains,
+                             _arc_consistency_in_place, ac4,
+                             arc_consistency_incremental,
+                             bitmask_values, from_bitmask,
+                             get_arcs_by_variable, get_initial_arcs,
+                             get_initial_bitmasks, get_initial_domains,
+                             get_split_agenda, is_bitmask_csp, to_bitmask)
 
-def domain_splitting(csp: CSP, debug: bool=True) -> Iterable[Dict[str, Any]]:
+logger = logging.getLogger(__name__)
+
+def domain_splitting(csp: CSP, parallel_depth: int=0, *,
+                     use_ac4: bool=False) -> Iterable[Dict[str, Any]]:
     """
     Solve a CSP using domain splitting and arc consistency.
 
     Generate assignment of all variables with exactly one value,
     if CSP has a solution.
     If the CSP has no solution, the returned iterator is empty.
+
+    If `parallel_depth` > 0, the domains are split up to `parallel_depth`
+    times and the resulting sub problems are solved in parallel processes.
+    This is only useful to find all solutions.
+
+    If `use_ac4` is True, the initial domains are made arc consistent
+    by `ac4` instead of revising arcs.
     """
-    domains = arc_consistency(csp)
+    bitmask = is_bitmask_csp(csp)
+    if use_ac4:
+        consistent = ac4(csp)
+        domains = [consistent[var] for var in csp.var_names]
+        if bitmask:
+            domains = [to_bitmask(domain) for domain in domains]
+    elif bitmask:
+        domains = get_initial_bitmasks(csp)
+        domains = _arc_consistency_in_place(csp, domains, bitmask=True)
+    else:
+        domains = get_initial_domains(csp)
+        domains = _arc_consistency_in_place(csp, domains)
 
-    if some_empty(domains):
-        pass # no solution
-    elif unique(domains):
-        yield {var: list(domain)[0]
-               for var, domain in domains.items()}
+    if parallel_depth > 0 and "fork" in multiprocessing.get_all_start_methods():
+        return _parallel_domain_splitting(csp, domains, bitmask,
+                                          parallel_depth)
+    return _domain_splitting(csp, domains, bitmask=bitmask)
+
+def _domain_splitting(csp: CSP, domains: Domains, *,
+                      bitmask: bool = False) -> Iterable[Dict[str, Any]]:
+    """
+    Search part of `domain_splitting`.
+    `domains` are the arc consistent domains of `csp`.
+    If `bitmask` is True, the domains are bitmasks.
+    """
+    var_to_arcs = get_arcs_by_variable(get_initial_arcs(csp))
+
+    # Iterators over sub problems that still need to be solved.
+    # Their domains are consistent except for the arcs in the agenda.
+    stack = [iter([(domains, Agenda())])]
+    while stack:
+        sub_problem = next(stack[-1], None)
+        if sub_problem is None:
+            stack.pop()
+            continue
+        domains, agenda = sub_problem
+        domains = arc_consistency_incremental(csp, domains, agenda,
+                                              bitmask=bitmask,
+                                              var_to_arcs=var_to_arcs)
+
+        if some_empty(domains):
+            pass # no solution
+        elif bitmask and unique_bitmask(domains):
+            yield {var: next(bitmask_values(domain))
+                   for var, domain in zip(csp.var_names, domains)}
+        elif not bitmask and unique(domains):
+            yield {var: list(domain)[0]
+                   for var, domain in zip(csp.var_names, domains)}
+        else:
+            stack.append(split(csp, domains, var_to_arcs, bitmask))
+
+def split(csp: CSP, domains: Domains, var_to_arcs: Dict[int, List[Arc]],
+          bitmask: bool) -> Iterable[Tuple[Domains, Agenda]]:
+    """
+    Split the domain of one variable in two parts.
+    Generate the new domains for each part together with the agenda of arcs
+    that need to be rechecked to make them arc consistent again.
+    The second part is only made when it is requested, i.e. not at all,
+    if the search stops in the first part.
+    `domains` must have a variable with more than one value.
+    """
+    if bitmask:
+        split_var = get_split_var_bitmask(domains)
+        partition = partition_bitmask(domains[split_var])
     else:
         split_var = get_split_var(domains)
         partition = partition_domain(domains[split_var])
-        new_csps = [make_split_csp(csp, domains, split_var, split_domain)
-                    for split_domain in partition]
 
-        if debug:
-            print("Split '{var}' in '{d1}' and '{d2}'"
-                  .format(var=split_var, d1=partition[0], d2=partition[1]))
+    if logger.isEnabledFor(logging.DEBUG):
+        shown = ([from_bitmask(part) for part in partition] if bitmask
+                 else partition)
+        logger.debug("Split '%s' in '%s' and '%s'",
+                     csp.var_names[split_var], shown[0], shown[1])
+
+    # The split domains are a fresh copy and can be made consistent in place.
+    yield (make_split_domains(domains, split_var, partition[0]),
+           get_split_agenda(split_var, var_to_arcs))
+    yield (make_split_domains(domains, split_var, partition[1]),
+           get_split_agenda(split_var, var_to_arcs))
+
+
+# The CSP solved by `_parallel_domain_splitting`.
+# Worker processes are forked and inherit it. So the constraints
+# do not need to be pickled.
+_parallel_csp: Optional[CSP] = None
+
+def _parallel_domain_splitting(csp: CSP, domains: Domains,
+                               bitmask: bool, parallel_depth: int
+                               ) -> Iterable[Dict[str, Any]]:
+    """
+    Split `domains` up to `parallel_depth` times and solve the
+    resulting sub problems in parallel processes.
+    The solutions of the sub problems are generated in the order
+    of the sub problems.
+    """
+    global _parallel_csp
+    _parallel_csp = csp
+
+    sub_problems = list(get_sub_problems(csp, domains, bitmask,
+                                         parallel_depth))
 
-        # TODO: Customize agenda so that not everything needs to be rechecked
-        for solution in domain_splitting(new_csps[0]):
-            yield solution
-        for solution in domain_splitting(new_csps[1]):
-            yield solution
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(mp_context=context) as executor:
+        futures = [executor.submit(_solve_sub_problem, sub_domains,
+                                   bitmask)
+                   for sub_domains in sub_problems]
+        for future in futures:
+            yield from future.result()
 
+def _solve_sub_problem(domains: Domains,
+                       bitmask: bool) -> List[Dict[str, Any]]:
+    """ Find all solutions of a sub problem in a worker process """
+    return list(_domain_splitting(_parallel_csp, domains,
+                                  bitmask=bitmask))
 
-def some_empty(domains: Dict[str, Set[Any]]) -> bool:
+def get_sub_problems(csp: CSP, domains: Domains,
+                     bitmask: bool, depth: int) -> Iterable[Domains]:
+    """
+    Generate the arc consistent domains of all sub problems that result from
+    splitting `domains` `depth` times.
+    Sub problems without solution are left out. Sub problems that cannot be
+    split any further are generated as they are.
+    """
+    if some_empty(domains):
+        return
+    is_unique = unique_bitmask if bitmask else unique
+    if depth == 0 or is_unique(domains):
+        yield domains
+        return
+    var_to_arcs = get_arcs_by_variable(get_initial_arcs(csp))
+    for new_domains, agenda in split(csp, domains, var_to_arcs, bitmask):
+        new_domains = arc_consistency_incremental(csp, new_domains, agenda,
+                                                  bitmask=bitmask,
+                                                  var_to_arcs=var_to_arcs)
+        yield from get_sub_problems(csp, new_domains, bitmask, depth - 1)
+
+
+def some_empty(domains: Domains) -> bool:
     """ The domain for at least one variable is empty. """
-    return any((not domain for domain in domains.values()))
+    return any((not domain for domain in domains))
 
-def unique(domains: Dict[str, Set[Any]]) -> bool:
+def unique(domains: List[Set[Any]]) -> bool:
     """ Each variable has exactly one value """
     return all((len(domain) == 1
-                for domain in domains.values()))
+                for domain in domains))
+
+def unique_bitmask(domains: List[int]) -> bool:
+    """
+    Each variable has at most one value.
+    Domains are bitmasks.
+    """
+    return all((domain & (domain - 1) == 0
+                for domain in domains))
 
-def get_split_var(domains: Dict[str, Set[Any]]) -> str:
+def get_split_var(domains: List[Set[Any]]) -> int:
     """
     Get a variable that can be used for splitting (has more
     than one possible value).
     """
-    # Just select the first one that is found
-    # TODO: One could implement better selection strategies.
-    for var, domain in domains.items():
-        if len(domain) > 1:
-            return var
-    # Not reachable because otherwise the solution
-    # is unique and needs no splitting
-    assert False
+    # The variable with the smallest domain, so that a dead end is
+    # detected with as few splits as possible (fail first)
+    return min((var for var in range(len(domains))
+                if len(domains[var]) > 1),
+               key=lambda var: len(domains[var]))
 
-def partition_domain(domain: Set[Any]) -> Tuple[Set[Any], Set[Any]]:
+def get_split_var_bitmask(domains: List[int]) -> int:
     """
-    Partition a domain into two parts and return the two parts
+    Get a variable that can be used for splitting (has more
+    than one possible value).
+    Domains are bitmasks.
     """
-    part1 = set()
-    part2 = set()
+    sizes = [bin(domain).count("1") for domain in domains]
+    return min((var for var in range(len(domains)) if sizes[var] > 1),
+               key=lambda var: sizes[var])
 
-    # Add each value to either part1 or part2
-    for value, new_part in zip(domain, itertools.cycle([part1, part2])):
-        new_part.add(value)
+def partition_domain(domain: Set[Any]) -> Tuple[Set[Any], Set[Any]]:
+    """
+    Partition a domain into two parts and return the two parts.
+    If the values can be ordered, the first part gets the lower half
+    of the values and the second part the upper half.
+    """
+    try:
+        values = sorted(domain)
+    except TypeError:
+        # Values cannot be compared, so just split in any order
+        values = list(domain)
+    middle = len(values) // 2
+    return set(values[:middle]), set(values[middle:])
 
-    return part1, part2
 
+def partition_bitmask(domain: int) -> Tuple[int, int]:
+    """
+    Partition a bitmask domain with at least two values into a part with
+    the lower and a part with the higher values and return the two parts
+    """
+    values = list(bitmask_values(domain))
+    middle = values[len(values) // 2]
+    lower = domain & ((1 << middle) - 1)
+    return lower, domain ^ lower
 
-def make_split_csp(csp: CSP, new_domains: Dict[str, Set[Any]],
-                   split_var: str, split_domain: Set[Any]) -> CSP:
-    """ Make a new CSP with split_var's domain replaced by new_domain """
-    domains = new_domains.copy()
-    domains.update({split_var: split_domain})
-    return CSP(variables=domains,
-               constraints=csp.constraints,
-               representation=csp.representation)
 
+def make_split_domains(new_domains: Domains, split_var: int,
+                       split_domain: Any) -> Domains:
+    """ Make new domains with split_var's domain replaced by split_domain """
+    domains = list(new_domains)
+    domains[split_var] = split_domain
+    return domains
@@ -0,0 +1,210 @@
+# MIT License
+#
+# Copyright (c) 2019 Tobias Klinke
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+""" Tests of the arc consistency algorithms """
+import functools
+import itertools
+import operator
+import types
+import unittest
+
+from arc_consistency import (ac4, arc_consistency, compare_bitmasks,
+                             compare_domains, from_bitmask, to_bitmask)
+from csp import CSP, Constraint, get_comparison
+from domain_splitting import domain_splitting
+
+
+def all_different(**values):
+    return len(set(values.values())) == len(values)
+
+
+def increasing(**values):
+    ordered = [values[var] for var in sorted(values)]
+    return ordered == sorted(set(ordered))
+
+
+def sum_is_five(A, B, C):
+    return A + B + C == 5
+
+
+def same(A, B):
+    return A == B
+
+
+def is_float(A):
+    return isinstance(A, float)
+
+
+def less(A, B):
+    return A < B
+
+
+def negate(function):
+    @functools.wraps(function)
+    def negated(*args, **kwargs):
+        return not function(*args, **kwargs)
+    return negated
+
+
+greater_equal = negate(less)
+
+
+def solve_module(variables, constraints):
+    """ Get all solutions of a CSP loaded like by `CSP.from_module` """
+    module = types.SimpleNamespace(Variables=variables,
+                                   Constraints=constraints)
+    csp = CSP.from_module(module)
+    return sorted(tuple(sorted(solution.items()))
+                  for solution in domain_splitting(csp))
+
+
+class TestAC4(unittest.TestCase):
+    """
+    AC-4 has to compute the same domains as `arc_consistency`.
+    """
+
+    def assert_same_domains(self, csp):
+        self.assertEqual(ac4(csp), arc_consistency(csp))
+
+    def test_shared_function(self):
+        # Two constraints with the same function must not be mixed up
+        csp = CSP(
+            {"A": {1}, "B": {1, 2}, "C": {2, 3}},
+            [
+                Constraint(all_different, variables=["A", "B"]),
+                Constraint(all_different, variables=["B", "C"]),
+            ],
+            None,
+        )
+        self.assertEqual(ac4(csp), {"A": {1}, "B": {2}, "C": {3}})
+        self.assert_same_domains(csp)
+
+    def test_chain(self):
+        domains = set(range(4))
+        csp = CSP(
+            {"A": domains, "B": domains, "C": domains},
+            [
+                Constraint(increasing, variables=["A", "B"]),
+                Constraint(increasing, variables=["B", "C"]),
+            ],
+            None,
+        )
+        self.assert_same_domains(csp)
+
+    def test_non_binary(self):
+        domains = set(range(5))
+        csp = CSP(
+            {"A": domains, "B": {3, 4}, "C": domains},
+            [
+                Constraint(sum_is_five),
+                Constraint(increasing, variables=["A", "C"]),
+            ],
+            None,
+        )
+        self.assert_same_domains(csp)
+
+    def test_domain_splitting(self):
+        domains = set(range(4))
+        csp = CSP(
+            {"A": domains, "B": domains, "C": domains},
+            [
+                Constraint(all_different, variables=["A", "B", "C"]),
+                Constraint(increasing, variables=["A", "C"]),
+            ],
+            None,
+        )
+        solutions = sorted(tuple(solution.values())
+                           for solution in domain_splitting(csp))
+        self.assertEqual(sorted(tuple(solution.values()) for solution
+                                in domain_splitting(csp, use_ac4=True)),
+                         solutions)
+
+
+class TestComparisons(unittest.TestCase):
+    """
+    Constraints that compare two variables are propagated by set operations.
+    The result has to be the same as checking all pairs of values.
+    """
+
+    OPERATORS = {"==": operator.eq, "!=": operator.ne,
+                 "<": operator.lt, "<=": operator.le,
+                 ">": operator.gt, ">=": operator.ge}
+
+    DOMAINS = [set(), {0}, {3}, {0, 5}, {1, 2, 3}, {2, 4, 6, 7}]
+
+    def supported(self, comparison, current_domain, other_domain):
+        compare = self.OPERATORS[comparison]
+        return {a for a in current_domain
+                if any(compare(a, b) for b in other_domain)}
+
+    def test_get_comparison(self):
+        self.assertEqual(get_comparison(same), "==")
+        self.assertEqual(get_comparison(less), "<")
+        self.assertIsNone(get_comparison(sum_is_five))
+        self.assertIsNone(get_comparison(greater_equal))
+
+    def test_compare_domains(self):
+        for comparison in self.OPERATORS:
+            for current_domain, other_domain in itertools.product(
+                    self.DOMAINS, repeat=2):
+                with self.subTest(comparison=comparison,
+                                  current_domain=current_domain,
+                                  other_domain=other_domain):
+                    self.assertEqual(
+                        compare_domains(comparison, current_domain,
+                                        other_domain),
+                        self.supported(comparison, current_domain,
+                                       other_domain))
+
+    def test_compare_bitmasks(self):
+        for comparison in self.OPERATORS:
+            for current_domain, other_domain in itertools.product(
+                    self.DOMAINS, repeat=2):
+                with self.subTest(comparison=comparison,
+                                  current_domain=current_domain,
+                                  other_domain=other_domain):
+                    self.assertEqual(
+                        from_bitmask(compare_bitmasks(
+                            comparison, to_bitmask(current_domain),
+                            to_bitmask(other_domain))),
+                        self.supported(comparison, current_domain,
+                                       other_domain))
+
+    def test_equal_values_of_other_type(self):
+        # 1.0 == 1, but A must get the value from its own domain
+        solutions = solve_module({"A": {1.0, 2.5}, "B": {1}},
+                                 [same, is_float])
+        self.assertEqual(solutions, [(("A", 1.0), ("B", 1))])
+        self.assertIsInstance(solutions[0][0][1], float)
+
+    def test_wrapped_function(self):
+        domains = {1, 2, 3}
+        solutions = solve_module({"A": domains, "B": domains},
+                                 [greater_equal])
+        self.assertEqual(solutions, [(("A", a), ("B", b))
+                                     for a in sorted(domains)
+                                     for b in sorted(domains) if a >= b])
+
+
+if __name__ == "__main__":
+    unittest.main()